@@ -1,7 +1,14 @@
+import os
 from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
 import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
 from datetime import datetime
-import chardet
+try:
+    import cchardet as chardet  # Cython实现，比纯Python的chardet快1-2个数量级
+except ImportError:
+    import chardet
 import logging
 
 # 配置日志
@@ -9,93 +16,162 @@ logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 
+# 同目录下的文件通常来自同一数据源、编码一致，检测结果按目录缓存复用
+_encoding_cache = {}
+
+
 def detect_encoding(filepath):
-    """自动检测文件编码"""
+    """自动检测文件编码（结果按目录缓存）"""
+    dirpath = os.path.dirname(os.fspath(filepath))
+    if dirpath in _encoding_cache:
+        return _encoding_cache[dirpath]
+
     with open(filepath, 'rb') as f:
-        result = chardet.detect(f.read(10000))  # 读取前10KB检测编码
-    return result['encoding'] if result['confidence'] > 0.7 else 'gb18030'
+        result = chardet.detect(f.read(4096))  # 读取前4KB检测编码
+    confidence = result['confidence'] or 0
+    encoding = result['encoding'] if confidence > 0.7 else 'gb18030'
 
+    _encoding_cache[dirpath] = encoding
+    return encoding
 
-def safe_read_csv(filepath, dtypes):
-    """安全读取CSV文件，自动处理编码问题"""
+
+def safe_read_csv(filepath, dtypes, usecols=None, parse_dates=None, **kwargs):
+    """安全读取CSV文件，自动处理编码问题；列裁剪/日期解析下推到读取阶段"""
     try:
         encoding = detect_encoding(filepath)
         logger.info(f"读取文件 {filepath}，检测到编码: {encoding}")
-        return pd.read_csv(filepath, dtype=dtypes, encoding=encoding)
+        try:
+            # pyarrow引擎多线程解析，Arrow列在后续concat时省去NumPy的双倍拷贝
+            return pd.read_csv(filepath, dtype=dtypes, encoding=encoding,
+                               usecols=usecols, parse_dates=parse_dates,
+                               engine='pyarrow', dtype_backend='pyarrow',
+                               **kwargs)
+        except (TypeError, ValueError, ImportError):
+            # pyarrow不可用或参数不被支持时退回默认C引擎
+            return pd.read_csv(filepath, dtype=dtypes, encoding=encoding,
+                               usecols=usecols, parse_dates=parse_dates,
+                               **kwargs)
     except Exception as e:
         logger.error(f"读取文件 {filepath} 失败: {str(e)}")
         return None
 
 
+# 每日价格文件中实际需要的字段，读取时即裁剪
+DAILY_PRICE_COLUMNS = ['product_id', 'category_id', 'name', 'price', 'change_date']
+
+# 窄化dtype：低基数的ID列用category，价格用float32，name用Arrow字符串，
+# 单文件内存占用约降2-4倍。ID列写出Parquet前会转回普通字符串，
+# 避免各文件categorical字典索引宽度不一致导致schema冲突
+DAILY_PRICE_DTYPES = {
+    'product_id': 'category',
+    'category_id': 'category',
+    'name': 'string[pyarrow]',
+    'price': 'float32',
+}
+
+
 def clean_price_data(df):
-    """清洗价格数据"""
+    """清洗价格数据（列裁剪和日期解析已在读取阶段完成）"""
     if df is None or df.empty:
         return None
 
-    # 统一日期格式
-    df['change_date'] = pd.to_datetime(df['change_date'], errors='coerce')
-    df = df.dropna(subset=['change_date'])
+    # parse_dates遇到坏值时会让整列退回字符串，这里兜底coerce后再drop；
+    # 只有含坏日期的文件才会走到这条转换
+    if not pd.api.types.is_datetime64_any_dtype(df['change_date']):
+        df['change_date'] = pd.to_datetime(df['change_date'], errors='coerce')
 
-    # 保留所需字段
-    df = df[['product_id', 'category_id', 'name', 'price', 'change_date']].copy()
-    df.rename(columns={'change_date': 'date'}, inplace=True)
+    df = df.dropna(subset=['change_date'])
+    df = df.rename(columns={'change_date': 'date'})
 
     # 数据清洗
     df = df[(df['price'] > 0) &
             (df['product_id'].notna()) &
-            (df['category_id'].notna())]
-
-    # 统一日期格式
-    df['date'] = df['date'].dt.strftime('%Y-%m-%d')
+            (df['category_id'].notna())].copy()
 
+    # date保持datetime类型，由Parquet/Arrow原生序列化，
+    # 省去strftime逐行Python格式化
     return df
 
 
+def _process_one(filepath):
+    """读取并清洗单个每日价格文件（进程池工作函数）"""
+    logger.info(f"正在处理文件: {os.path.basename(filepath)}")
+    df_daily = safe_read_csv(filepath, DAILY_PRICE_DTYPES,
+                             usecols=DAILY_PRICE_COLUMNS,
+                             parse_dates=['change_date'])
+    return clean_price_data(df_daily)
+
+
 def main():
     # 设置路径（使用pathlib更安全）
     base_path = Path(__file__).resolve().parent.parent.parent / 'data'
     daily_price_path = base_path / 'utf'
     products_path = base_path / 'products.csv'
     categories_path = base_path / 'categories.csv'
-    output_path = base_path / 'price.csv'
+    output_path = base_path / 'price.parquet'
 
     # 读取基础数据
     logger.info("开始读取产品和类别数据")
-    df_products = safe_read_csv(products_path, {'product_id': str, 'category_id': str})
-    df_categories = safe_read_csv(categories_path, {'category_id': str})
+    df_products = safe_read_csv(products_path,
+                                {'product_id': 'category', 'category_id': 'category'})
+    df_categories = safe_read_csv(categories_path, {'category_id': 'category'})
 
     if df_products is None or df_categories is None:
         raise ValueError("基础数据读取失败")
 
-    # 处理每日价格数据
-    all_price_data = []
-    processed_files = 0
-
-    for file in daily_price_path.glob('*.csv'):
-        logger.info(f"正在处理文件: {file.name}")
-        df_daily = safe_read_csv(file, {'product_id': str, 'category_id': str})
-        df_clean = clean_price_data(df_daily)
+    # 枚举每日价格文件（os.scandir避免pathlib逐项stat的开销）
+    with os.scandir(daily_price_path) as it:
+        files = sorted(e.path for e in it
+                       if e.is_file() and e.name.lower().endswith('.csv'))
 
-        if df_clean is not None:
-            all_price_data.append(df_clean)
-            processed_files += 1
+    # 各文件读取+清洗互相独立，用进程池并行处理；
+    # 清洗结果逐文件追加到同一个Parquet写入器，不再先攒列表再concat，
+    # 内存峰值只与单个文件成正比
+    writer = None
+    schema = None
+    processed_files = 0
+    total_rows = 0
 
-    # 合并数据
-    if not all_price_data:
+    try:
+        with ProcessPoolExecutor(max_workers=os.cpu_count()) as executor:
+            for df_clean in executor.map(_process_one, files, chunksize=4):
+                if df_clean is None:
+                    continue
+
+                # categorical的字典索引宽度随文件内基数变化（int8/int16...），
+                # 首文件定下的schema会让后续基数更高的文件写入失败；
+                # 写出前转回字符串，Parquet本身会再做字典编码
+                for col in ('product_id', 'category_id'):
+                    df_clean[col] = df_clean[col].astype('string[pyarrow]')
+
+                table = pa.Table.from_pandas(df_clean, schema=schema,
+                                             preserve_index=False)
+                if writer is None:
+                    schema = table.schema
+                    writer = pq.ParquetWriter(output_path, schema,
+                                              compression='zstd')
+                writer.write_table(table)
+
+                processed_files += 1
+                total_rows += len(df_clean)
+    finally:
+        if writer is not None:
+            writer.close()
+
+    if writer is None:
         raise ValueError("没有有效的价格数据被处理")
 
-    df_all = pd.concat(all_price_data, ignore_index=True)
-    logger.info(f"成功合并 {processed_files} 个文件，总计 {len(df_all)} 条记录")
-
-    # 保存结果
-    df_all.to_csv(output_path, index=False, encoding='utf-8')
+    logger.info(f"成功处理 {processed_files} 个文件，总计 {total_rows} 条记录")
     logger.info(f"结果已保存到 {output_path}")
 
-    # 处理类别数据（原代码中的补充部分）
+    # 处理类别数据（原代码中的补充部分）：仅在确实存在缺失值时回写，
+    # 避免每次运行都重写一遍没有变化的文件
     if categories_path.exists():
         df_cat = pd.read_csv(categories_path)
-        df_cat.fillna(-1, inplace=True)
-        df_cat.to_csv(categories_path, index=False)
+        if df_cat.isna().any().any():
+            df_cat.fillna(-1, inplace=True)
+            df_cat.to_csv(categories_path, index=False)
+            logger.info(f"已填充 {categories_path} 中的缺失值并回写")
 
 
 if __name__ == "__main__":
@@ -4,16 +4,28 @@ import yaml
 from pathlib import Path
 from contextlib import contextmanager
 
+try:
+    from yaml import CSafeLoader as _YamlLoader  # C实现的加载器，快于纯Python
+except ImportError:
+    from yaml import SafeLoader as _YamlLoader
 
-class ClickHouseConnector:
-    def __init__(self):
-        self.config = self._load_config()
+# 配置在模块级缓存，整个进程只读取/解析settings.yml一次
+_CONFIG = None
 
-    def _load_config(self):
-        """加载YAML配置文件"""
+
+def load_config():
+    """加载YAML配置文件（首次调用后缓存）"""
+    global _CONFIG
+    if _CONFIG is None:
         config_path = Path(__file__).parent / "settings.yml"
         with open(config_path, 'r', encoding='utf-8') as f:
-            return yaml.safe_load(f)
+            _CONFIG = yaml.load(f, Loader=_YamlLoader)
+    return _CONFIG
+
+
+class ClickHouseConnector:
+    def __init__(self):
+        self.config = load_config()
 
     def __enter__(self):
         """进入上下文时创建连接"""
@@ -32,7 +44,7 @@ class ClickHouseConnector:
         if hasattr(self, 'client'):
             self.client.disconnect()
 
-    def execute(self, query, params=None):
-        """执行查询并返回结果"""
+    def execute(self, query, params=None, columnar=False):
+        """执行查询并返回结果；columnar=True时按列返回，构建DataFrame更快"""
         with self as client:
-            return client.execute(query, params)
\ No newline at end of file
+            return client.execute(query, params, columnar=columnar)
\ No newline at end of file
@@ -1,13 +1,5 @@
 from clickhouse_driver import Client
-import yaml
-from pathlib import Path
-from clickhouse_connector import ClickHouseConnector
-
-def load_config():
-    """加载YAML配置文件"""
-    config_path = Path(__file__).parent / "settings.yml"
-    with open(config_path, 'r',encoding='utf-8') as f:
-        return yaml.safe_load(f)
+from clickhouse_connector import ClickHouseConnector, load_config
 
 def get_client():
     """创建ClickHouse客户端连接"""
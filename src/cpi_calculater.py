@@ -1,5 +1,7 @@
 # cpi_calculator.py
 import pandas as pd
+import matplotlib
+matplotlib.use('Agg')  # 无头服务器上避免加载GUI后端
 import matplotlib.pyplot as plt
 from datetime import datetime
 import logging
@@ -18,118 +20,174 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 
-def calculate_cpi(granularity='month'):
-    """计算CPI（支持按月和按天计算）"""
+# 基期和统计区间
+_QUERY_PARAMS = {'base_start': '2025-05-17', 'base_end': '2026-05-17',
+                 'start_date': '2025-05-17', 'end_date': '2028-05-15'}
+
+
+def _normalize_cpi(cpi_result, granularity):
+    """以数据中最早时间点为动态基期标准化，并按粒度重命名列"""
+    if len(cpi_result) == 0:
+        raise ValueError("CPI计算结果为空，请检查输入数据")
+
+    base_date = cpi_result['time_period'].min()
+    base_cpi = cpi_result.loc[cpi_result['time_period'] == base_date, 'cpi'].values[0]
+
+    # 标准化计算
+    cpi_result['cpi_index'] = (cpi_result['cpi'] / base_cpi) * 100
+    logger.info(f"使用动态基期: {base_date}")
+
+    # 重命名列以区分粒度
+    return cpi_result.rename(columns={
+        'time_period': f'time_period_{granularity}',
+        'cpi_index': f'cpi_index_{granularity}'
+    })
+
+
+def calculate_cpi(granularity='month', client=None):
+    """计算CPI（支持按月和按天计算）；传入client可跨调用复用同一连接"""
     try:
         logger.info(f"开始计算{granularity}粒度CPI...")
 
-        # 使用上下文管理器自动处理连接
-        with ClickHouseConnector() as client:
-            # 1. 获取基期数据
-            base_query = """
-            SELECT 
+        # 时间粒度只影响聚合键
+        if granularity == 'month':
+            time_expr = 'toStartOfMonth(toDate(date))'
+        else:  # day
+            time_expr = 'toDate(date)'
+
+        # 基期均价、分期均价、权重的合并和加权平均全部下推到ClickHouse，
+        # 客户端只收到每个时间段一行的聚合结果
+        cpi_query = f"""
+        WITH base AS (
+            SELECT
                 category_id,
                 avg(price) as base_price
             FROM commodity_prices
-            WHERE date BETWEEN %(start_date)s AND %(end_date)s
+            WHERE date BETWEEN %(base_start)s AND %(base_end)s
             GROUP BY category_id
-            """
-            logger.debug(f"执行基期查询: {base_query}")
-            base_prices = client.execute(
-                base_query,
-                {'start_date': '2025-05-17', 'end_date': '2026-05-17'}
-            )
-            base_df = pd.DataFrame(base_prices, columns=['category_id', 'base_price'])
-            logger.info(f"获取到 {len(base_df)} 个品类的基期价格")
-
-            # 2. 获取时间粒度数据
-            if granularity == 'month':
-                time_query = """
-                SELECT 
-                    toStartOfMonth(toDate(date)) as time_period,
-                    category_id,
-                    avg(price) as avg_price
-                FROM commodity_prices
-                WHERE date BETWEEN %(start_date)s AND %(end_date)s
-                GROUP BY time_period, category_id
-                ORDER BY time_period
-                """
-            else:  # day
-                time_query = """
-                SELECT 
-                    toDate(date) as time_period,
-                    category_id,
-                    avg(price) as avg_price
-                FROM commodity_prices
-                WHERE date BETWEEN %(start_date)s AND %(end_date)s
-                GROUP BY time_period, category_id
-                ORDER BY time_period
-                """
-
-            logger.debug(f"执行{granularity}粒度查询: {time_query}")
-            time_data = client.execute(
-                time_query,
-                {'start_date': '2025-05-17', 'end_date': '2028-05-15'}
-            )
-            time_df = pd.DataFrame(time_data, columns=['time_period', 'category_id', 'avg_price'])
-            logger.info(f"获取到 {len(time_df)} 条{granularity}粒度价格记录")
-
-            # 3. 获取品类权重
-            weight_query = "SELECT category_id, weight FROM categories WHERE hierarchy = '3'"
-            logger.debug(f"执行权重查询: {weight_query}")
-            weights = client.execute(weight_query)
-            weight_df = pd.DataFrame(weights, columns=['category_id', 'weight'])
-            logger.info(f"获取到 {len(weight_df)} 个品类权重")
-
-        # 4. 合并计算 (连接已自动关闭)
-        logger.info(f"开始合并计算{granularity}粒度CPI...")
-        merged = time_df.merge(base_df, on='category_id', how='inner') \
-            .merge(weight_df, on='category_id', how='inner')
-
-        # 强制转换为数值类型，非数字转为NaN
-        merged['avg_price'] = pd.to_numeric(merged['avg_price'], errors='coerce')
-        merged['base_price'] = pd.to_numeric(merged['base_price'], errors='coerce')
-        merged['weight'] = pd.to_numeric(merged['weight'], errors='coerce')
-
-        if merged.empty:
-            raise ValueError("数据合并后为空，请检查品类ID匹配")
-
-        if merged['base_price'].isna().any():
-            logger.warning(f"发现 {merged['base_price'].isna().sum()} 条无效基期价格记录")
-
-        merged['price_index'] = (merged['avg_price'] / merged['base_price']) * 100
-        logger.debug(f"合并后数据样例:\n{merged.head()}")
-
-        # 5. 计算加权CPI
-        merged['weighted'] = merged['price_index'] * merged['weight']
-        cpi_result = merged.groupby('time_period').agg(
-            total_weight=('weight', 'sum'),
-            total_weighted=('weighted', 'sum')
         )
-        cpi_result['cpi'] = cpi_result['total_weighted'] / cpi_result['total_weight']
-        cpi_result = cpi_result.reset_index()[['time_period', 'cpi']]
+        SELECT
+            t.time_period,
+            sum((t.avg_price / base.base_price) * 100 * w.weight)
+                / sum(w.weight) as cpi
+        FROM (
+            SELECT
+                {time_expr} as time_period,
+                category_id,
+                avg(price) as avg_price
+            FROM commodity_prices
+            WHERE date BETWEEN %(start_date)s AND %(end_date)s
+            GROUP BY time_period, category_id
+        ) as t
+        INNER JOIN base USING (category_id)
+        INNER JOIN (
+            SELECT category_id, weight
+            FROM categories
+            WHERE hierarchy = '3'
+        ) as w USING (category_id)
+        GROUP BY time_period
+        ORDER BY time_period
+        """
+
+        logger.debug(f"执行{granularity}粒度CPI查询: {cpi_query}")
+
+        # columnar=True按列返回，DataFrame按整列构建，省去逐行元组物化
+        if client is not None:
+            # 复用调用方传入的连接，避免每次查询重新握手+认证
+            cpi_cols = client.execute(cpi_query, _QUERY_PARAMS, columnar=True)
+        else:
+            with ClickHouseConnector() as own_client:
+                cpi_cols = own_client.execute(cpi_query, _QUERY_PARAMS,
+                                              columnar=True)
+
+        if not cpi_cols:
+            cpi_cols = [(), ()]
+        # ClickHouse返回的已是数值类型，直接声明dtype即可，
+        # 无需pd.to_numeric(errors='coerce')的逐格转换
+        cpi_result = pd.DataFrame({'time_period': pd.to_datetime(cpi_cols[0]),
+                                   'cpi': cpi_cols[1]}).astype({'cpi': 'float64'})
+        logger.info(f"获取到 {len(cpi_result)} 条{granularity}粒度CPI记录")
+
+        return _normalize_cpi(cpi_result, granularity)
 
-        # 动态确定基期（使用数据中的最早时间点）
-        if len(cpi_result) == 0:
-            raise ValueError("CPI计算结果为空，请检查输入数据")
+    except Exception as e:
+        logger.error(f"{granularity}粒度CPI计算失败: {str(e)}", exc_info=True)
+        raise
 
-        base_date = cpi_result['time_period'].min()
-        base_cpi = cpi_result.loc[cpi_result['time_period'] == base_date, 'cpi'].values[0]
 
-        # 标准化计算
-        cpi_result['cpi_index'] = (cpi_result['cpi'] / base_cpi) * 100
-        logger.info(f"使用动态基期: {base_date}")
+def calculate_cpi_combined(client=None):
+    """单次扫描同时计算月粒度和日粒度CPI，返回(monthly, daily)
 
-        # 重命名列以区分粒度
-        cpi_result = cpi_result.rename(columns={
-            'time_period': f'time_period_{granularity}',
-            'cpi_index': f'cpi_index_{granularity}'
-        })
+    月/日两种粒度只差一个聚合键，用GROUPING SETS让ClickHouse在一次
+    commodity_prices扫描里同时产出两套聚合，基期和权重也只计算一次。
+    """
+    try:
+        logger.info("开始计算月+日粒度CPI（单次扫描）...")
 
-        return cpi_result
+        cpi_query = """
+        WITH base AS (
+            SELECT
+                category_id,
+                avg(price) as base_price
+            FROM commodity_prices
+            WHERE date BETWEEN %(base_start)s AND %(base_end)s
+            GROUP BY category_id
+        )
+        SELECT
+            t.d,
+            t.m,
+            sum((t.avg_price / base.base_price) * 100 * w.weight)
+                / sum(w.weight) as cpi
+        FROM (
+            SELECT
+                toDate(date) as d,
+                toStartOfMonth(toDate(date)) as m,
+                category_id,
+                avg(price) as avg_price
+            FROM commodity_prices
+            WHERE date BETWEEN %(start_date)s AND %(end_date)s
+            GROUP BY GROUPING SETS ((d, category_id), (m, category_id))
+        ) as t
+        INNER JOIN base USING (category_id)
+        INNER JOIN (
+            SELECT category_id, weight
+            FROM categories
+            WHERE hierarchy = '3'
+        ) as w USING (category_id)
+        GROUP BY t.d, t.m
+        ORDER BY t.d, t.m
+        """
+        logger.debug(f"执行合并粒度CPI查询: {cpi_query}")
+
+        if client is not None:
+            cpi_cols = client.execute(cpi_query, _QUERY_PARAMS, columnar=True)
+        else:
+            with ClickHouseConnector() as own_client:
+                cpi_cols = own_client.execute(cpi_query, _QUERY_PARAMS,
+                                              columnar=True)
+
+        if not cpi_cols:
+            cpi_cols = [(), (), ()]
+        combined = pd.DataFrame({'d': pd.to_datetime(cpi_cols[0]),
+                                 'm': pd.to_datetime(cpi_cols[1]),
+                                 'cpi': cpi_cols[2]}).astype({'cpi': 'float64'})
+        logger.info(f"获取到 {len(combined)} 条合并粒度CPI记录")
+
+        # GROUPING SETS中未参与分组的日期键被填为默认值1970-01-01，
+        # 据此把结果切分成两种粒度
+        epoch = pd.Timestamp('1970-01-01')
+        monthly = (combined.loc[combined['d'] == epoch, ['m', 'cpi']]
+                   .rename(columns={'m': 'time_period'})
+                   .reset_index(drop=True))
+        daily = (combined.loc[combined['m'] == epoch, ['d', 'cpi']]
+                 .rename(columns={'d': 'time_period'})
+                 .reset_index(drop=True))
+
+        return (_normalize_cpi(monthly, 'month'),
+                _normalize_cpi(daily, 'day'))
 
     except Exception as e:
-        logger.error(f"{granularity}粒度CPI计算失败: {str(e)}", exc_info=True)
+        logger.error(f"合并粒度CPI计算失败: {str(e)}", exc_info=True)
         raise
 
 
@@ -161,7 +219,7 @@ def visualize_combined_cpi(monthly_data, daily_data):
         output_dir = Path('output')
         output_dir.mkdir(exist_ok=True)
         plot_path = output_dir / 'combined_cpi_trend.png'
-        plt.savefig(plot_path, dpi=300)
+        plt.savefig(plot_path, dpi=120)  # 14x7折线图120dpi足够，文件小得多
         plt.close()
 
         logger.info(f"组合CPI趋势图已保存到 {plot_path}")
@@ -174,14 +232,11 @@ def visualize_combined_cpi(monthly_data, daily_data):
 def save_combined_results(monthly_data, daily_data):
     """保存合并结果到CSV"""
     try:
-        # 合并两个数据集
-        daily_data['time_period_day'] = pd.to_datetime(daily_data['time_period_day'])
-        monthly_data['time_period_month'] = pd.to_datetime(monthly_data['time_period_month'])
-
-        # 合并两个数据集
+        # time_period列在calculate_cpi构建时已是datetime，且查询结果
+        # 按时间有序，无需再次to_datetime解析和sort_values拷贝
         combined = pd.merge_asof(
-            daily_data.sort_values('time_period_day'),
-            monthly_data.sort_values('time_period_month'),
+            daily_data,
+            monthly_data,
             left_on='time_period_day',
             right_on='time_period_month',
             direction='nearest'
@@ -204,9 +259,9 @@ if __name__ == "__main__":
     try:
         logger.info("====== CPI计算程序开始 ======")
 
-        # 计算两种粒度的CPI
-        monthly_data = calculate_cpi(granularity='month')
-        daily_data = calculate_cpi(granularity='day')
+        # 一次扫描同时算出两种粒度的CPI（共用一个连接）
+        with ClickHouseConnector() as client:
+            monthly_data, daily_data = calculate_cpi_combined(client=client)
 
         # 保存和可视化结果
         save_combined_results(monthly_data, daily_data)